@@ -11,7 +11,6 @@
     pkgs = nixpkgs.legacyPackages.${system};
     runtimePython = pkgs.python313.withPackages (pyPkgs: [
       pyPkgs.prometheus-client
-      pyPkgs.python-dateutil
       pyPkgs.python-dotenv
       pyPkgs.python-slugify
       pyPkgs.requests
@@ -19,7 +18,6 @@
     devPython = pkgs.python313.withPackages (pyPkgs: [
       pyPkgs.black
       pyPkgs.prometheus-client
-      pyPkgs.python-dateutil
       pyPkgs.python-dotenv
       pyPkgs.python-slugify
       pyPkgs.requests
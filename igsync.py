@@ -1,23 +1,23 @@
 #!/usr/bin/env python3
 
 import argparse
+import base64
+import itertools
 import logging
 import os
 import re
 import requests
+import shutil
 import sqlite3
-from dateutil import parser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 from pathlib import Path
-from prometheus_client import (
-    CollectorRegistry,
-    Gauge,
-    push_to_gateway,
-    write_to_textfile,
-)
-from requests.auth import HTTPBasicAuth
-from slugify import slugify
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+# prometheus_client and slugify are imported where they are used, so
+# runs that never reach them (--fetch-only, --no-prometheus) skip the import.
 
 logging.basicConfig(format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
@@ -32,49 +32,130 @@ CATEGORY_ID = os.environ["CATEGORY_ID"]
 PROMETHEUS_PUSH_GATEWAY = os.environ.get("PROMETHEUS_PUSH_GATEWAY", "")
 PROMETHEUS_TEXTFILE_PATH = os.environ.get("PROMETHEUS_TEXTFILE_PATH", "")
 DB_PATH = "instagram_posts.db"
+INSTAGRAM_WORKERS = 8
+WORDPRESS_WORKERS = 4
+DOWNLOAD_CHUNK_SIZE = 1 << 17
+RETRY_AFTER_MAX = 120
+_TAG_RE = re.compile(r"#\w+")
+_MEDIA_EXTENSIONS = {"IMAGE": ".jpg", "VIDEO": ".mp4"}
+MEDIA_BLOCK_TEMPLATES = {
+    "IMAGE": '<!-- wp:image {{"id":{id}}} --><figure class="wp-block-image"><img src="{url}" alt="" class="wp-image-{id}"/></figure><!-- /wp:image -->',
+    "VIDEO": '<!-- wp:video {{"id":{id}}} --><figure class="wp-block-video"><video controls src="{url}"></video></figure><!-- /wp:video -->',
+}
 
 Path("media").mkdir(exist_ok=True)
 
 
+class CappedRetry(Retry):
+    """Retry policy that waits at most RETRY_AFTER_MAX seconds for Retry-After.
+
+    urllib3 otherwise honours waits of up to six hours per attempt, which
+    would stall a cron run; older versions have no retry_after_max option.
+    """
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, RETRY_AFTER_MAX)
+
+
+def build_session(pool_maxsize):
+    """Create a keep-alive session that backs off and retries on 429/5xx."""
+    session = requests.Session()
+    # Only idempotent methods are retried on a bad status; a POST that got a
+    # 5xx may still have created its post or tag. Once retries run out the
+    # last response is returned so callers log it as before.
+    retry = CappedRetry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session.mount("https://", HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry))
+    return session
+
+
+# Pagination runs on the main thread alongside the workers, so it needs a
+# connection of its own.
+IG_SESSION = build_session(INSTAGRAM_WORKERS + 1)
+# Encode the credentials once instead of on every request
+_WP_AUTH = "Basic " + base64.b64encode(
+    f"{WORDPRESS_USERNAME}:{WORDPRESS_APPLICATION_PASSWORD}".encode()
+).decode()
+
+
+def _wp_auth(request):
+    """Add the precomputed WordPress Basic auth header to a request."""
+    request.headers["Authorization"] = _WP_AUTH
+    return request
+
+
+WP_SESSION = build_session(WORDPRESS_WORKERS)
+# Set as session auth rather than a default header so requests never
+# replaces it with credentials from ~/.netrc.
+WP_SESSION.auth = _wp_auth
+
+
 def init_db(db_path):
     """Initialize SQLite database with posts and media tables."""
     conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute(
+    # WAL with synchronous=NORMAL fsyncs only at checkpoints, not every commit.
+    (journal_mode,) = conn.execute("PRAGMA journal_mode=WAL").fetchone()
+    if journal_mode not in ("wal", "memory"):
+        logger.warning(f"SQLite is using {journal_mode} journal mode instead of WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-32768")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute(
         """CREATE TABLE IF NOT EXISTS posts
                  (id TEXT PRIMARY KEY, caption TEXT, media_type TEXT, permalink TEXT, timestamp TEXT, posted_to_wp INTEGER DEFAULT 0)"""
     )
-    c.execute(
+    conn.execute(
         """CREATE TABLE IF NOT EXISTS media
                  (media_id TEXT PRIMARY KEY, post_id TEXT, media_type TEXT, media_url TEXT, local_path TEXT,
                   wp_media_id INTEGER, wp_url TEXT,
                   FOREIGN KEY(post_id) REFERENCES posts(id))"""
     )
-    c.execute(
+    conn.execute(
         """CREATE TABLE IF NOT EXISTS token_metadata
                  (key TEXT PRIMARY KEY, value TEXT, updated_at TEXT)"""
     )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS tags
+                 (name TEXT PRIMARY KEY, wp_id INTEGER)"""
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_posts_pending ON posts(posted_to_wp) WHERE posted_to_wp = 0"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_post ON media(post_id)")
     conn.commit()
     return conn
 
 
+def parse_timestamp(value):
+    """Parse an ISO-8601 timestamp as returned by Instagram or stored by us."""
+    return datetime.fromisoformat(
+        value.replace("Z", "+00:00").replace("+0000", "+00:00")
+    )
+
+
 def get_token_from_db(conn):
     """Get Instagram token and expiration from database."""
-    c = conn.cursor()
-    c.execute(
+    token_row = conn.execute(
         "SELECT value FROM token_metadata WHERE key = 'instagram_access_token'"
-    )
-    token_row = c.fetchone()
-    c.execute(
+    ).fetchone()
+    expires_row = conn.execute(
         "SELECT value FROM token_metadata WHERE key = 'instagram_token_expires_at'"
-    )
-    expires_row = c.fetchone()
+    ).fetchone()
 
     token = token_row[0] if token_row else None
     expires_at = None
     if expires_row and expires_row[0]:
         try:
-            expires_at = parser.parse(expires_row[0])
+            expires_at = parse_timestamp(expires_row[0])
         except:
             logger.warning("Failed to parse token expiration date from database")
 
@@ -83,14 +164,13 @@ def get_token_from_db(conn):
 
 def set_token_in_db(conn, access_token, expires_at):
     """Store Instagram token and expiration in database."""
-    c = conn.cursor()
     now = datetime.now(timezone.utc).isoformat()
 
-    c.execute(
+    conn.execute(
         "INSERT OR REPLACE INTO token_metadata (key, value, updated_at) VALUES (?, ?, ?)",
         ("instagram_access_token", access_token, now),
     )
-    c.execute(
+    conn.execute(
         "INSERT OR REPLACE INTO token_metadata (key, value, updated_at) VALUES (?, ?, ?)",
         ("instagram_token_expires_at", expires_at.isoformat(), now),
     )
@@ -104,7 +184,7 @@ def refresh_token(current_token, conn):
     logger.info("Attempting to refresh Instagram access token...")
 
     try:
-        response = requests.get(url)
+        response = IG_SESSION.get(url)
         if response.status_code == 200:
             data = response.json()
             new_token = data.get("access_token")
@@ -168,17 +248,26 @@ def get_active_token(conn):
     return env_token
 
 
+def get_known_post_ids(conn, post_ids):
+    """Return the subset of post_ids already stored, using the primary key index."""
+    placeholders = ", ".join("?" * len(post_ids))
+    rows = conn.execute(f"SELECT id FROM posts WHERE id IN ({placeholders})", post_ids)
+    return {row[0] for row in rows}
+
+
 def fetch_instagram_posts(access_token, conn):
-    """Fetch new Instagram posts with pagination."""
-    c = conn.cursor()
-    c.execute("SELECT id FROM posts")
-    existing_ids = set(row[0] for row in c.fetchall())
-    posts = []
+    """Yield pages of new Instagram posts, newest first, until caught up.
+
+    Raises RuntimeError if a page can't be fetched. Pagination stops at the
+    first stored post, so storing a run cut short by an error would make the
+    older posts look already synced.
+    """
+    post_count = 0
     url = f"https://graph.instagram.com/me/media?fields=id,caption,media_type,media_url,permalink,timestamp&access_token={access_token}"
     page = 1
     while url:
         logger.debug(f"Fetching page {page}...")
-        response = requests.get(url)
+        response = IG_SESSION.get(url)
         if response.status_code != 200:
             logger.error(f"Error fetching posts: {response.status_code}")
             try:
@@ -186,23 +275,25 @@ def fetch_instagram_posts(access_token, conn):
                 logger.error(f"Error details: {error_data}")
             except:
                 logger.error(f"Response text: {response.text}")
-            break
+            raise RuntimeError(f"Error fetching posts page {page}")
         data = response.json()
         page_posts = data["data"]
-        new_posts = [post for post in page_posts if post["id"] not in existing_ids]
-        posts.extend(new_posts)
-        if not new_posts or "next" not in data["paging"]:
+        known_ids = get_known_post_ids(conn, [post["id"] for post in page_posts])
+        new_posts = [post for post in page_posts if post["id"] not in known_ids]
+        post_count += len(new_posts)
+        yield new_posts
+        # Posts come newest first, so any stored post means we've caught up.
+        if known_ids or not new_posts or "next" not in data["paging"]:
             break
         url = data["paging"]["next"]
         page += 1
-    logger.info(f"Fetched {len(posts)} new posts from {page} pages")
-    return posts
+    logger.info(f"Fetched {post_count} new posts from {page} pages")
 
 
 def fetch_children(post_id, access_token):
     """Fetch media children for carousel posts."""
     url = f"https://graph.instagram.com/{post_id}/children?fields=id,media_type,media_url&access_token={access_token}"
-    response = requests.get(url)
+    response = IG_SESSION.get(url)
     if response.status_code == 200:
         return response.json()["data"]
     logger.error(f"Error fetching children for post {post_id}: {response.status_code}")
@@ -214,170 +305,351 @@ def fetch_children(post_id, access_token):
     return []
 
 
-def download_media(media_url, local_path):
-    """Download media from Instagram."""
-    if Path(local_path).exists():
-        logger.debug(f"Media {local_path} already exists, skipping download")
-        return
-    logger.debug(f"Downloading {media_url} to {local_path}")
-    response = requests.get(media_url, stream=True)
-    if response.status_code == 200:
-        with open(local_path, "wb") as f:
-            for chunk in response.iter_content(1024):
-                f.write(chunk)
-        logger.debug(f"Downloaded {local_path}")
+def get_remote_size(media_url):
+    """Return the Content-Length Instagram reports for media_url, if any."""
+    response = IG_SESSION.head(media_url, allow_redirects=True)
+    if response.status_code != 200 or "Content-Length" not in response.headers:
+        return None
+    return int(response.headers["Content-Length"])
+
+
+def list_local_media():
+    """Return the names of the files already in the media directory."""
+    try:
+        with os.scandir("media") as entries:
+            return frozenset(entry.name for entry in entries)
+    except FileNotFoundError:
+        return frozenset()
+
+
+def download_media(media_url, local_path, local_files=None):
+    """Download media from Instagram.
+
+    local_files, from list_local_media, saves a stat per file when given.
+    """
+    if local_files is None:
+        exists = Path(local_path).exists()
     else:
-        logger.error(f"Error downloading {media_url}: {response.status_code}")
+        exists = os.path.basename(local_path) in local_files
+    if exists:
+        local_size = os.path.getsize(local_path)
+        remote_size = get_remote_size(media_url)
+        if remote_size is None or remote_size == local_size:
+            logger.debug(f"Media {local_path} already exists, skipping download")
+            return
+        logger.warning(
+            f"Media {local_path} has {local_size} bytes, expected {remote_size}; downloading again"
+        )
+    logger.debug(f"Downloading {media_url} to {local_path}")
+    with IG_SESSION.get(media_url, stream=True) as response:
+        if response.status_code != 200:
+            logger.error(f"Error downloading {media_url}: {response.status_code}")
+            return
+        # Write under a temporary name so an interrupted download never
+        # leaves a truncated file that later runs would treat as complete.
+        partial_path = f"{local_path}.partial"
+        response.raw.decode_content = True
+        with open(partial_path, "wb") as f:
+            shutil.copyfileobj(response.raw, f, DOWNLOAD_CHUNK_SIZE)
+    os.replace(partial_path, local_path)
+    logger.debug(f"Downloaded {local_path}")
+
+
+def insert_posts(conn, posts):
+    """Insert posts into the database in one statement. The caller commits."""
+    conn.executemany(
+        "INSERT OR IGNORE INTO posts (id, caption, media_type, permalink, timestamp, posted_to_wp) VALUES (?, ?, ?, ?, ?, 0)",
+        [
+            (
+                post["id"],
+                post.get("caption", ""),
+                post["media_type"],
+                post["permalink"],
+                post.get("timestamp", ""),
+            )
+            for post in posts
+        ],
+    )
 
 
 def insert_post(conn, post):
-    """Insert a post into the database."""
-    c = conn.cursor()
-    c.execute(
-        "INSERT OR IGNORE INTO posts (id, caption, media_type, permalink, timestamp, posted_to_wp) VALUES (?, ?, ?, ?, ?, 0)",
-        (
-            post["id"],
-            post.get("caption", ""),
-            post["media_type"],
-            post["permalink"],
-            post.get("timestamp", ""),
-        ),
+    """Insert a post into the database. The caller commits."""
+    insert_posts(conn, [post])
+
+
+def insert_media_rows(conn, rows):
+    """Insert (media_id, post_id, media_type, media_url, local_path) rows. The caller commits."""
+    conn.executemany(
+        "INSERT OR IGNORE INTO media (media_id, post_id, media_type, media_url, local_path) VALUES (?, ?, ?, ?, ?)",
+        rows,
     )
-    conn.commit()
 
 
 def insert_media(conn, media_id, post_id, media_type, media_url):
-    """Insert media metadata into the database."""
+    """Insert media metadata into the database. The caller commits."""
     local_path = get_local_path(media_id, media_type)
-    c = conn.cursor()
-    c.execute(
-        "INSERT OR IGNORE INTO media (media_id, post_id, media_type, media_url, local_path) VALUES (?, ?, ?, ?, ?)",
-        (media_id, post_id, media_type, media_url, local_path),
-    )
-    conn.commit()
+    insert_media_rows(conn, [(media_id, post_id, media_type, media_url, local_path)])
 
 
 def get_local_path(media_id, media_type):
     """Generate local file path for media."""
-    ext = ".jpg" if media_type == "IMAGE" else ".mp4"
-    return f"media/{media_id}{ext}"
-
-
-def extract_tags(caption):
-    """Extract hashtags from the caption."""
-    return re.findall(r"#\w+", caption)
-
+    return "media/" + media_id + _MEDIA_EXTENSIONS.get(media_type, ".mp4")
+
+
+def split_caption(caption):
+    """Split the caption into its tags and the text without them, in one pass.
+
+    Tags come back without '#', deduplicated case-insensitively with the
+    first spelling kept.
+    """
+    tags = {}
+    parts = []
+    last = 0
+    for match in _TAG_RE.finditer(caption):
+        name = match.group()[1:]
+        tags.setdefault(name.lower(), name)
+        parts.append(caption[last : match.start()])
+        last = match.end()
+    parts.append(caption[last:])
+    return list(tags.values()), "".join(parts).strip()
+
+
+def get_cached_tags(conn):
+    """Get the lowercased tag name -> WordPress ID mapping saved by earlier runs."""
+    return dict(conn.execute("SELECT name, wp_id FROM tags"))
+
+
+def store_tags(conn, tags, replace=False):
+    """Save lowercased tag name -> WordPress ID mappings. The caller commits.
+
+    With replace, mappings not in tags are dropped, for when tags is a full
+    listing of the site's tags.
+    """
+    if replace:
+        conn.execute("DELETE FROM tags")
+    conn.executemany(
+        "INSERT OR REPLACE INTO tags (name, wp_id) VALUES (?, ?)", tags.items()
+    )
 
-def remove_tags(caption):
-    """Remove hashtags from the caption."""
-    return re.sub(r"#\w+", "", caption).strip()
 
+def load_all_wp_tags(wordpress_url):
+    """Fetch every WordPress tag, returning a mapping of lowercased name to ID.
 
-def get_or_create_tag(tag_name, auth, wordpress_url):
-    """Get tag ID if it exists, or create it and return the new ID."""
-    tag_name = tag_name.lstrip("#")
-    response = requests.get(
-        f"{wordpress_url}/wp-json/wp/v2/tags", params={"search": tag_name}, auth=auth
-    )
-    if response.status_code == 200:
-        tags = response.json()
-        for tag in tags:
-            if tag["name"].lower() == tag_name.lower():
-                return tag["id"]
-    # Tag doesn't exist, create it
-    response = requests.post(
-        f"{wordpress_url}/wp-json/wp/v2/tags", json={"name": tag_name}, auth=auth
+    Returns None if any page could not be fetched.
+    """
+    tags = {}
+    page = 1
+    while True:
+        response = WP_SESSION.get(
+            f"{wordpress_url}/wp-json/wp/v2/tags",
+            params={"per_page": 100, "page": page, "_fields": "id,name"},
+        )
+        if response.status_code != 200:
+            logger.error(f"Error fetching tags page {page}: {response.status_code}")
+            return None
+        for tag in response.json():
+            tags[tag["name"].lower()] = tag["id"]
+        if page >= int(response.headers.get("X-WP-TotalPages", 1)):
+            break
+        page += 1
+    logger.debug(f"Loaded {len(tags)} WordPress tags")
+    return tags
+
+
+def find_live_tag_ids(tag_ids, wordpress_url):
+    """Return which of tag_ids still exist on WordPress, or None on error."""
+    tag_ids = sorted(tag_ids)
+    live = set()
+    for start in range(0, len(tag_ids), 100):
+        response = WP_SESSION.get(
+            f"{wordpress_url}/wp-json/wp/v2/tags",
+            params={
+                "include": ",".join(map(str, tag_ids[start : start + 100])),
+                "per_page": 100,
+                "_fields": "id",
+            },
+        )
+        if response.status_code != 200:
+            logger.error(f"Error checking saved tags: {response.status_code}")
+            return None
+        live.update(tag["id"] for tag in response.json())
+    return live
+
+
+def get_or_create_tag(tag_name, cache, wordpress_url):
+    """Get tag ID from the cache, or create the tag and cache the new ID."""
+    key = tag_name.lower()
+    if key in cache:
+        return cache[key]
+    response = WP_SESSION.post(
+        f"{wordpress_url}/wp-json/wp/v2/tags",
+        params={"_fields": "id"},
+        json={"name": tag_name},
     )
     if response.status_code == 201:
-        return response.json()["id"]
+        cache[key] = response.json()["id"]
+        return cache[key]
+    # The tag may exist without having been loaded, e.g. if a listing page failed
+    if response.status_code == 400:
+        try:
+            error = response.json()
+        except ValueError:
+            error = {}
+        if error.get("code") == "term_exists":
+            cache[key] = error["data"]["term_id"]
+            return cache[key]
     logger.debug(f"Error creating tag {tag_name}: {response.status_code}")
     return None
 
 
-def handle_media(conn, media_list):
+def create_missing_tags(pending_posts, cache):
+    """Concurrently create every tag the pending posts use that isn't cached yet."""
+    missing = {}
+    for _, _, (tags, _) in pending_posts:
+        for tag in tags:
+            if tag.lower() not in cache:
+                missing.setdefault(tag.lower(), tag)
+    if not missing:
+        return
+    logger.debug(f"Creating {len(missing)} new WordPress tags")
+    # Each worker adds a different key, so sharing the cache dict is safe.
+    with ThreadPoolExecutor(max_workers=WORDPRESS_WORKERS) as executor:
+        list(
+            executor.map(
+                get_or_create_tag,
+                missing.values(),
+                itertools.repeat(cache),
+                itertools.repeat(WORDPRESS_SITE_URL),
+            )
+        )
+
+
+def handle_media(conn, media_list, existing_uploads):
     """Handle media uploads and return a mapping of media IDs to WordPress IDs and URLs."""
     wp_media_map = {}
-    c = conn.cursor()
+    to_upload = []
+    updates = []
     for media in media_list:
         media_id, media_type, local_path, wp_media_id, wp_url = media
         if wp_media_id:
             logger.debug(f"Using existing media {media_id} with ID {wp_media_id}")
             wp_media_map[media_id] = (wp_media_id, wp_url)
+        elif existing := existing_uploads.get(upload_slug(local_path)):
+            wp_media_id, wp_url = existing
+            logger.debug(f"Reusing WordPress media {wp_media_id} for {media_id}")
+            updates.append((wp_media_id, wp_url, media_id))
+            wp_media_map[media_id] = (wp_media_id, wp_url)
         else:
-            wp_media_id, wp_url = upload_media_to_wordpress(local_path, media_type)
-            if wp_media_id:
-                c.execute(
-                    "UPDATE media SET wp_media_id = ?, wp_url = ? WHERE media_id = ?",
-                    (wp_media_id, wp_url, media_id),
-                )
-                conn.commit()
-                logger.debug(f"Uploaded media {media_id} with ID {wp_media_id}")
-                wp_media_map[media_id] = (wp_media_id, wp_url)
+            to_upload.append(media)
+
+    # Uploads run on the pool; SQLite updates stay on this thread and are
+    # written even if a later upload raises, so finished uploads are kept.
+    try:
+        with ThreadPoolExecutor(max_workers=WORDPRESS_WORKERS) as executor:
+            futures = {
+                executor.submit(upload_media_to_wordpress, local_path, media_type): media_id
+                for media_id, media_type, local_path, _, _ in to_upload
+            }
+            for future in as_completed(futures):
+                media_id = futures[future]
+                wp_media_id, wp_url = future.result()
+                if wp_media_id:
+                    logger.debug(f"Uploaded media {media_id} with ID {wp_media_id}")
+                    updates.append((wp_media_id, wp_url, media_id))
+                    wp_media_map[media_id] = (wp_media_id, wp_url)
+    finally:
+        conn.executemany(
+            "UPDATE media SET wp_media_id = ?, wp_url = ? WHERE media_id = ?", updates
+        )
     return wp_media_map
 
 
-def format_caption(caption):
-    """Format caption by removing tags and adding paragraph blocks."""
-    caption = remove_tags(caption)
-    lines = caption.split("\n")
-    formatted = ""
-    for line in lines:
-        if line.strip():
-            formatted += (
-                f"<!-- wp:paragraph --><p>{line.strip()}</p><!-- /wp:paragraph -->"
-            )
-    return formatted
+def format_caption(text):
+    """Format caption text, already stripped of tags, as paragraph blocks."""
+    return "".join(
+        f"<!-- wp:paragraph --><p>{line.strip()}</p><!-- /wp:paragraph -->"
+        for line in text.splitlines()
+        if line.strip()
+    )
 
 
-def build_content(media_list, wp_media_map, caption):
+def build_content(media_list, wp_media_map, text):
     """Build the post content using block markup."""
-    content = ""
-    for media in media_list:
-        media_id, media_type, _, _, _ = media
-        if media_id in wp_media_map:
-            wp_media_id, wp_url = wp_media_map[media_id]
-            if media_type == "IMAGE":
-                content += f'<!-- wp:image {{"id":{wp_media_id}}} --><figure class="wp-block-image"><img src="{wp_url}" alt="" class="wp-image-{wp_media_id}"/></figure><!-- /wp:image -->'
-            elif media_type == "VIDEO":
-                content += f'<!-- wp:video {{"id":{wp_media_id}}} --><figure class="wp-block-video"><video controls src="{wp_url}"></video></figure><!-- /wp:video -->'
-    content += format_caption(caption)
-    return content
+    parts = [
+        MEDIA_BLOCK_TEMPLATES[media_type].format(
+            id=wp_media_map[media_id][0], url=wp_media_map[media_id][1]
+        )
+        for media_id, media_type, *_ in media_list
+        if media_id in wp_media_map and media_type in MEDIA_BLOCK_TEMPLATES
+    ]
+    parts.append(format_caption(text))
+    return "".join(parts)
 
 
 def get_pending_posts(conn):
     """Retrieve posts not yet posted to WordPress."""
-    c = conn.cursor()
-    c.execute(
+    return conn.execute(
         "SELECT id, caption, media_type, timestamp FROM posts WHERE posted_to_wp = 0"
-    )
-    return c.fetchall()
+    ).fetchall()
 
 
-def get_media_for_post(conn, post_id):
-    """Get media items for a post, including wp_media_id and wp_url."""
-    c = conn.cursor()
-    c.execute(
-        "SELECT media_id, media_type, local_path, wp_media_id, wp_url FROM media WHERE post_id = ?",
-        (post_id,),
+def get_pending_posts_with_media(conn):
+    """Retrieve pending posts paired with their media lists, in a single query."""
+    rows = conn.execute(
+        """SELECT p.id, p.caption, p.media_type, p.timestamp,
+                  m.media_id, m.media_type, m.local_path, m.wp_media_id, m.wp_url
+           FROM posts p LEFT JOIN media m ON m.post_id = p.id
+           WHERE p.posted_to_wp = 0
+           ORDER BY p.rowid, m.rowid"""
     )
-    return c.fetchall()
+    return [
+        (post, [row[4:] for row in post_rows if row[4] is not None])
+        for post, post_rows in itertools.groupby(rows, key=lambda row: row[:4])
+    ]
+
+
+def upload_slug(local_path):
+    """Return the WordPress attachment slug igsync uploads a media file under."""
+    return f"instagram-{Path(local_path).stem}"
+
+
+def find_wp_uploads(slugs, wordpress_url):
+    """Look up already-uploaded media by slug, returning slug -> (ID, URL)."""
+    uploads = {}
+    for start in range(0, len(slugs), 100):
+        response = WP_SESSION.get(
+            f"{wordpress_url}/wp-json/wp/v2/media",
+            params={
+                "slug": ",".join(slugs[start : start + 100]),
+                "per_page": 100,
+                "_fields": "id,slug,source_url",
+            },
+        )
+        if response.status_code != 200:
+            logger.error(f"Error looking up existing media: {response.status_code}")
+            continue
+        for item in response.json():
+            uploads[item["slug"]] = (item["id"], item["source_url"])
+    logger.debug(f"Found {len(uploads)} of {len(slugs)} media already on WordPress")
+    return uploads
 
 
 def upload_media_to_wordpress(local_path, media_type):
     """Upload media to WordPress."""
     content_type = "image/jpeg" if media_type == "IMAGE" else "video/mp4"
-    filename = "instagram_image.jpg" if media_type == "IMAGE" else "instagram_video.mp4"
+    # The filename determines the attachment slug, which find_wp_uploads matches on.
+    filename = upload_slug(local_path) + Path(local_path).suffix
     headers = {
         "Content-Type": content_type,
         "Content-Disposition": f'attachment; filename="{filename}"',
     }
     logger.debug(f"Uploading {local_path} to WordPress")
     with open(local_path, "rb") as f:
-        response = requests.post(
+        response = WP_SESSION.post(
             f"{WORDPRESS_SITE_URL}/wp-json/wp/v2/media",
+            params={"_fields": "id,source_url"},
             headers=headers,
             data=f,
-            auth=HTTPBasicAuth(WORDPRESS_USERNAME, WORDPRESS_APPLICATION_PASSWORD),
         )
     if response.status_code == 201:
         data = response.json()
@@ -390,8 +662,7 @@ def upload_media_to_wordpress(local_path, media_type):
 def create_wordpress_post(title, content, slug, featured_media, tag_ids, timestamp):
     """Create a post on WordPress."""
     if timestamp:
-        dt = parser.parse(timestamp)
-        formatted_timestamp = dt.isoformat()
+        formatted_timestamp = parse_timestamp(timestamp).isoformat()
     else:
         formatted_timestamp = datetime.now(timezone.utc).isoformat()
     post_data = {
@@ -406,11 +677,11 @@ def create_wordpress_post(title, content, slug, featured_media, tag_ids, timesta
     if featured_media:
         post_data["featured_media"] = featured_media
     logger.debug(f"Creating post with title '{title}' and date '{formatted_timestamp}'")
-    response = requests.post(
+    response = WP_SESSION.post(
         f"{WORDPRESS_SITE_URL}/wp-json/wp/v2/posts",
+        params={"_fields": "id"},
         headers={"Content-Type": "application/json"},
         json=post_data,
-        auth=HTTPBasicAuth(WORDPRESS_USERNAME, WORDPRESS_APPLICATION_PASSWORD),
     )
     if response.status_code == 201:
         logger.debug("Post created successfully")
@@ -421,105 +692,195 @@ def create_wordpress_post(title, content, slug, featured_media, tag_ids, timesta
 
 def reset_media_uploads(conn):
     """Reset media upload records by setting wp_media_id and wp_url to NULL."""
-    c = conn.cursor()
-    c.execute("UPDATE media SET wp_media_id = NULL, wp_url = NULL")
+    cursor = conn.execute(
+        "UPDATE media SET wp_media_id = NULL, wp_url = NULL WHERE wp_media_id IS NOT NULL OR wp_url IS NOT NULL"
+    )
     conn.commit()
-    logger.info("Reset all media upload records.")
+    logger.info(f"Reset {cursor.rowcount} media upload records.")
 
 
 def mark_post_as_posted(conn, post_id):
-    """Mark a post as posted to WordPress."""
-    c = conn.cursor()
-    c.execute("UPDATE posts SET posted_to_wp = 1 WHERE id = ?", (post_id,))
-    conn.commit()
+    """Mark a post as posted to WordPress. The caller commits."""
+    conn.execute("UPDATE posts SET posted_to_wp = 1 WHERE id = ?", (post_id,))
+
+
+def media_row(item, post_id):
+    """Build an insert_media_rows row for a post or carousel child."""
+    return (
+        item["id"],
+        post_id,
+        item["media_type"],
+        item["media_url"],
+        get_local_path(item["id"], item["media_type"]),
+    )
+
+
+def fetch_and_download_children(post_id, access_token, local_files):
+    """Fetch a carousel's children and download each, returning their media rows."""
+    rows = [
+        media_row(child, post_id) for child in fetch_children(post_id, access_token)
+    ]
+    for _, _, _, media_url, local_path in rows:
+        download_media(media_url, local_path, local_files)
+    return rows
 
 
 def fetch_and_store_instagram_posts(conn):
     """Fetch and store new Instagram posts, returning the count."""
     token = get_active_token(conn)
-    posts = fetch_instagram_posts(token, conn)
-    for post in posts:
-        logger.debug(f"Processing post {post['id']}")
-        insert_post(conn, post)
-        if post["media_type"] == "CAROUSEL_ALBUM":
-            children = fetch_children(post["id"], token)
-            for child in children:
-                insert_media(
-                    conn,
-                    child["id"],
-                    post["id"],
-                    child["media_type"],
-                    child["media_url"],
-                )
-                download_media(
-                    child["media_url"], get_local_path(child["id"], child["media_type"])
-                )
-        else:
-            insert_media(
-                conn, post["id"], post["id"], post["media_type"], post["media_url"]
-            )
-            download_media(
-                post["media_url"], get_local_path(post["id"], post["media_type"])
-            )
+    local_files = list_local_media()
+    posts = []
+    single_rows = {}
+    carousels = {}
+    downloads = []
+    # Database writes stay on this thread; only HTTP work goes to the pool.
+    # The whole batch is one transaction, committed once downloads finish
+    # and rolled back if any page fails.
+    with conn, ThreadPoolExecutor(max_workers=INSTAGRAM_WORKERS) as executor:
+        # Each page's downloads, and its carousels' children lookups and
+        # downloads, overlap fetching the next page.
+        for page_posts in fetch_instagram_posts(token, conn):
+            for post in page_posts:
+                posts.append(post)
+                if post["media_type"] == "CAROUSEL_ALBUM":
+                    carousels[post["id"]] = executor.submit(
+                        fetch_and_download_children, post["id"], token, local_files
+                    )
+                else:
+                    row = media_row(post, post["id"])
+                    single_rows[post["id"]] = row
+                    _, _, _, media_url, local_path = row
+                    downloads.append(
+                        executor.submit(
+                            download_media, media_url, local_path, local_files
+                        )
+                    )
+        media_rows = []
+        for post in posts:
+            logger.debug(f"Processing post {post['id']}")
+            if post["id"] in carousels:
+                # Resolves once the carousel's children are downloaded too
+                media_rows.extend(carousels[post["id"]].result())
+            else:
+                media_rows.append(single_rows[post["id"]])
+        insert_posts(conn, posts)
+        insert_media_rows(conn, media_rows)
+        for download in downloads:
+            download.result()
     logger.debug(f"Stored {len(posts)} new posts")
     return len(posts)
 
 
+def post_to_wordpress(
+    conn, post, media_list, caption_parts, tag_cache, existing_uploads, test_mode=False
+):
+    """Post a single pending post to WordPress, returning whether it was created.
+
+    caption_parts is the caption's split_caption result.
+    """
+    from slugify import slugify
+
+    post_id, caption, media_type, timestamp = post
+    caption = caption or ""
+    title = caption.split("\n", 1)[0] if "\n" in caption else caption
+    if not title:
+        title = "Untitled"
+    slug = slugify("Photo " + title)
+    logger.debug(f"Posting post {post_id} to WordPress")
+
+    wp_media_map = handle_media(conn, media_list, existing_uploads)
+    if len(wp_media_map) != len(media_list):
+        logger.error(f"Media upload failed for post {post_id}; leaving it pending")
+        return False
+
+    first_image_id = next((m[0] for m in media_list if m[1] == "IMAGE"), None)
+    featured_media = (
+        wp_media_map.get(first_image_id, (None, None))[0] if first_image_id else None
+    )
+
+    tags, text = caption_parts
+    content = build_content(media_list, wp_media_map, text)
+    tag_ids = [
+        tag_id
+        for tag in tags
+        if (tag_id := get_or_create_tag(tag, tag_cache, WORDPRESS_SITE_URL))
+    ]
+
+    if not create_wordpress_post(
+        title, content, slug, featured_media, tag_ids, timestamp
+    ):
+        return False
+    if not test_mode:
+        mark_post_as_posted(conn, post_id)
+    else:
+        logger.info(f"Test post created for post_id: {post_id}. Not marking as posted.")
+    logger.debug(f"Successfully posted post {post_id}")
+    return True
+
+
 def post_pending_to_wordpress(conn, test_mode=False):
     """Post pending Instagram posts to WordPress, returning the count."""
-    pending_posts = get_pending_posts(conn)
+    pending_posts = get_pending_posts_with_media(conn)
     if pending_posts:
         logger.info(f"Found {len(pending_posts)} pending posts to process")
     if test_mode:
         pending_posts = pending_posts[:1]
-
-    auth = HTTPBasicAuth(WORDPRESS_USERNAME, WORDPRESS_APPLICATION_PASSWORD)
+    # Each caption is scanned once; its tags and text are reused below
+    pending_posts = [
+        (post, media_list, split_caption(post[1] or ""))
+        for post, media_list in pending_posts
+    ]
+
+    # Tags seen by earlier runs are remembered; only list WordPress tags on a miss
+    tag_cache = get_cached_tags(conn)
+    needed_tags = {tag.lower() for _, _, (tags, _) in pending_posts for tag in tags}
+    # A saved ID goes stale when its tag is deleted or merged on WordPress,
+    # which would otherwise silently drop the tag from new posts.
+    saved = {name: tag_cache[name] for name in needed_tags & tag_cache.keys()}
+    live_ids = find_live_tag_ids(saved.values(), WORDPRESS_SITE_URL) if saved else None
+    if live_ids is not None:
+        for name, tag_id in saved.items():
+            if tag_id not in live_ids:
+                logger.debug(f"Saved tag {name} ({tag_id}) is gone from WordPress")
+                del tag_cache[name]
+    if not needed_tags <= tag_cache.keys():
+        wp_tags = load_all_wp_tags(WORDPRESS_SITE_URL)
+        if wp_tags is not None:
+            tag_cache = wp_tags
+        create_missing_tags(pending_posts, tag_cache)
+        store_tags(conn, tag_cache, replace=wp_tags is not None)
+        conn.commit()
+    # Media may already be on WordPress after --reset-media or an interrupted run
+    slugs = [
+        upload_slug(local_path)
+        for _, media_list, _ in pending_posts
+        for _, _, local_path, wp_media_id, _ in media_list
+        if not wp_media_id
+    ]
+    existing_uploads = find_wp_uploads(slugs, WORDPRESS_SITE_URL) if slugs else {}
     posted_count = 0
-    for post in pending_posts:
-        post_id, caption, media_type, timestamp = post
-        caption = caption or ""
-        title = caption.split("\n", 1)[0] if "\n" in caption else caption
-        if not title:
-            title = "Untitled"
-        slug = slugify("Photo " + title)
-        logger.debug(f"Posting post {post_id} to WordPress")
-
-        media_list = get_media_for_post(conn, post_id)
-        wp_media_map = handle_media(conn, media_list)
-        if len(wp_media_map) != len(media_list):
-            logger.error(f"Media upload failed for post {post_id}; leaving it pending")
-            continue
-
-        first_image_id = next((m[0] for m in media_list if m[1] == "IMAGE"), None)
-        featured_media = (
-            wp_media_map.get(first_image_id, (None, None))[0]
-            if first_image_id
-            else None
-        )
-
-        content = build_content(media_list, wp_media_map, caption)
-        tags = extract_tags(caption)
-        tag_ids = [
-            tag_id
-            for tag in tags
-            if (tag_id := get_or_create_tag(tag, auth, WORDPRESS_SITE_URL))
-        ]
-
-        if create_wordpress_post(
-            title, content, slug, featured_media, tag_ids, timestamp
-        ):
-            if not test_mode:
-                mark_post_as_posted(conn, post_id)
-            else:
-                logger.info(
-                    f"Test post created for post_id: {post_id}. Not marking as posted."
-                )
-            posted_count += 1
-            logger.debug(f"Successfully posted post {post_id}")
+    for post, media_list, caption_parts in pending_posts:
+        # Commit once per post, even on failure, so recorded media uploads
+        # and the posted flag are never lost to a later error.
+        try:
+            if post_to_wordpress(
+                conn,
+                post,
+                media_list,
+                caption_parts,
+                tag_cache,
+                existing_uploads,
+                test_mode,
+            ):
+                posted_count += 1
+        finally:
+            conn.commit()
     return posted_count
 
 
 def build_metrics_registry(new_instagram_posts, posted_to_wordpress, pending_posts):
+    from prometheus_client import CollectorRegistry, Gauge
+
     registry = CollectorRegistry()
     last_success = Gauge(
         "igsync_last_success_timestamp",
@@ -549,12 +910,35 @@ def build_metrics_registry(new_instagram_posts, posted_to_wordpress, pending_pos
 
 
 def write_textfile_metrics(path, new_instagram_posts, posted_to_wordpress, pending_posts):
+    from prometheus_client import write_to_textfile
+
     write_to_textfile(
         str(path),
         build_metrics_registry(new_instagram_posts, posted_to_wordpress, pending_posts),
     )
 
 
+def publish_metrics(
+    metrics_textfile, new_instagram_posts, posted_to_wordpress, pending_posts
+):
+    """Write metrics to the textfile if configured, else push them to the gateway."""
+    if metrics_textfile:
+        write_textfile_metrics(
+            metrics_textfile, new_instagram_posts, posted_to_wordpress, pending_posts
+        )
+        logger.debug(f"Wrote metrics to {metrics_textfile}")
+    elif PROMETHEUS_PUSH_GATEWAY:
+        from prometheus_client import push_to_gateway
+
+        registry = build_metrics_registry(
+            new_instagram_posts, posted_to_wordpress, pending_posts
+        )
+        push_to_gateway(PROMETHEUS_PUSH_GATEWAY, job="instagram_sync", registry=registry)
+        logger.debug(f"Pushed metrics to {PROMETHEUS_PUSH_GATEWAY}")
+    else:
+        logger.debug("No Prometheus metrics destination configured")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Sync Instagram posts to WordPress")
     parser.add_argument(
@@ -591,36 +975,31 @@ def main():
     new_instagram_posts = 0
     posted_to_wordpress = 0
     pending_posts = 0
-    try:
-        if fetch:
-            logger.info("Fetching new posts from Instagram...")
-            new_instagram_posts = fetch_and_store_instagram_posts(conn)
-        if post:
-            logger.info("Posting pending posts to WordPress...")
-            if args.reset_media:
-                reset_media_uploads(conn)
-            posted_to_wordpress = post_pending_to_wordpress(conn, args.test_post)
-        pending_posts = len(get_pending_posts(conn))
-    finally:
-        conn.close()
-
-    if not args.no_prometheus:
-        metrics_textfile = args.metrics_textfile or PROMETHEUS_TEXTFILE_PATH
-        if metrics_textfile:
-            write_textfile_metrics(
-                metrics_textfile, new_instagram_posts, posted_to_wordpress, pending_posts
-            )
-            logger.debug(f"Wrote metrics to {metrics_textfile}")
-        elif PROMETHEUS_PUSH_GATEWAY:
-            registry = build_metrics_registry(
-                new_instagram_posts, posted_to_wordpress, pending_posts
-            )
-            push_to_gateway(
-                PROMETHEUS_PUSH_GATEWAY, job="instagram_sync", registry=registry
-            )
-            logger.debug(f"Pushed metrics to {PROMETHEUS_PUSH_GATEWAY}")
-        else:
-            logger.debug("No Prometheus metrics destination configured")
+    publishing = None
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        try:
+            if fetch:
+                logger.info("Fetching new posts from Instagram...")
+                new_instagram_posts = fetch_and_store_instagram_posts(conn)
+            if post:
+                logger.info("Posting pending posts to WordPress...")
+                if args.reset_media:
+                    reset_media_uploads(conn)
+                posted_to_wordpress = post_pending_to_wordpress(conn, args.test_post)
+            pending_posts = len(get_pending_posts(conn))
+            if not args.no_prometheus:
+                # Publish while the database closes and checkpoints its WAL
+                publishing = executor.submit(
+                    publish_metrics,
+                    args.metrics_textfile or PROMETHEUS_TEXTFILE_PATH,
+                    new_instagram_posts,
+                    posted_to_wordpress,
+                    pending_posts,
+                )
+        finally:
+            conn.close()
+        if publishing:
+            publishing.result()
 
 
 if __name__ == "__main__":
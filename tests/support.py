@@ -0,0 +1,59 @@
+# ABOUTME: Shared helpers for the IGSync tests.
+# ABOUTME: Loads the script with dummy boundary env vars and seeds posts in SQLite.
+
+import importlib.util
+import os
+import tempfile
+from pathlib import Path
+
+
+IGSYNC_SOURCE = Path(
+    os.environ.get("IGSYNC_SOURCE", Path(__file__).resolve().parents[1] / "igsync.py")
+)
+
+
+def load_igsync():
+    """Import igsync.py from a scratch directory with dummy settings."""
+    env = {
+        "INSTAGRAM_ACCESS_TOKEN": "dummy",
+        "WORDPRESS_SITE_URL": "https://example.com",
+        "WORDPRESS_USERNAME": "dummy",
+        "WORDPRESS_APPLICATION_PASSWORD": "dummy",
+        "CATEGORY_ID": "1",
+        "PROMETHEUS_PUSH_GATEWAY": "http://127.0.0.1:1",
+    }
+    old_env = os.environ.copy()
+    old_cwd = os.getcwd()
+    try:
+        os.environ.update(env)
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            spec = importlib.util.spec_from_file_location("igsync", IGSYNC_SOURCE)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
+    finally:
+        os.chdir(old_cwd)
+        os.environ.clear()
+        os.environ.update(old_env)
+
+
+def store_post(
+    module,
+    conn,
+    post_id,
+    caption="Caption",
+    media_type="IMAGE",
+    timestamp="2026-07-16T20:00:00Z",
+):
+    """Insert a pending post the way ingest would store it."""
+    module.insert_post(
+        conn,
+        {
+            "id": post_id,
+            "caption": caption,
+            "media_type": media_type,
+            "permalink": f"https://instagram.example/{post_id}",
+            "timestamp": timestamp,
+        },
+    )
@@ -1,43 +1,17 @@
 # ABOUTME: Tests Prometheus textfile metric rendering for IGSync.
 # ABOUTME: Imports the script with dummy boundary env vars and no network access.
 
-import importlib.util
-import os
 import tempfile
 import unittest
 from pathlib import Path
 from unittest.mock import patch
 
-
-IGSYNC_SOURCE = Path(
-    os.environ.get("IGSYNC_SOURCE", Path(__file__).resolve().parents[1] / "igsync.py")
-)
+from support import load_igsync
 
 
 class MetricsTextfileTest(unittest.TestCase):
     def load_module(self):
-        env = {
-            "INSTAGRAM_ACCESS_TOKEN": "dummy",
-            "WORDPRESS_SITE_URL": "https://example.com",
-            "WORDPRESS_USERNAME": "dummy",
-            "WORDPRESS_APPLICATION_PASSWORD": "dummy",
-            "CATEGORY_ID": "1",
-            "PROMETHEUS_PUSH_GATEWAY": "http://127.0.0.1:1",
-        }
-        old_env = os.environ.copy()
-        old_cwd = os.getcwd()
-        try:
-            os.environ.update(env)
-            with tempfile.TemporaryDirectory() as workdir:
-                os.chdir(workdir)
-                spec = importlib.util.spec_from_file_location("igsync", IGSYNC_SOURCE)
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-                return module
-        finally:
-            os.chdir(old_cwd)
-            os.environ.clear()
-            os.environ.update(old_env)
+        return load_igsync()
 
     def test_writes_prefixed_metrics_to_textfile_atomically(self):
         module = self.load_module()
@@ -88,7 +62,7 @@ class MetricsTextfileTest(unittest.TestCase):
             "https://instagram.example/media-1.jpg",
         )
 
-        with patch.object(
+        with patch.object(module, "find_wp_uploads", return_value={}), patch.object(
             module, "upload_media_to_wordpress", return_value=(None, None)
         ), patch.object(module, "create_wordpress_post") as create_post:
             posted_count = module.post_pending_to_wordpress(conn)
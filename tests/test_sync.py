@@ -0,0 +1,352 @@
+# ABOUTME: Tests the Instagram fetch and WordPress posting steps of IGSync.
+# ABOUTME: Patches the HTTP sessions and helpers so no test touches the network.
+
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, Mock, patch
+
+from support import load_igsync, store_post
+
+
+class SyncTest(unittest.TestCase):
+    def test_reuses_media_already_uploaded_to_wordpress(self):
+        module = load_igsync()
+        conn = module.init_db(":memory:")
+        store_post(module, conn, "post-1")
+        module.insert_media(
+            conn,
+            "media-1",
+            "post-1",
+            "IMAGE",
+            "https://instagram.example/media-1.jpg",
+        )
+
+        with patch.object(
+            module,
+            "find_wp_uploads",
+            return_value={"instagram-media-1": (42, "https://example.com/media-1.jpg")},
+        ) as find_uploads, patch.object(
+            module, "upload_media_to_wordpress"
+        ) as upload, patch.object(
+            module, "create_wordpress_post", return_value=True
+        ):
+            posted_count = module.post_pending_to_wordpress(conn)
+
+        self.assertEqual(posted_count, 1)
+        self.assertEqual(find_uploads.call_args.args[0], ["instagram-media-1"])
+        upload.assert_not_called()
+        self.assertEqual(
+            conn.execute(
+                "SELECT wp_media_id, wp_url FROM media WHERE media_id = 'media-1'"
+            ).fetchone(),
+            (42, "https://example.com/media-1.jpg"),
+        )
+        conn.close()
+
+    def test_groups_pending_posts_with_their_media(self):
+        module = load_igsync()
+        conn = module.init_db(":memory:")
+        for post_id in ("post-1", "post-2", "post-3"):
+            store_post(
+                module, conn, post_id, caption=post_id, media_type="CAROUSEL_ALBUM"
+            )
+        module.insert_media(conn, "media-1", "post-1", "IMAGE", "https://x/1.jpg")
+        module.insert_media(conn, "media-2", "post-1", "VIDEO", "https://x/2.mp4")
+        module.insert_media(conn, "media-3", "post-3", "IMAGE", "https://x/3.jpg")
+        module.mark_post_as_posted(conn, "post-3")
+
+        pending = module.get_pending_posts_with_media(conn)
+
+        self.assertEqual([post[0] for post, _ in pending], ["post-1", "post-2"])
+        self.assertEqual(
+            pending[0][1],
+            [
+                ("media-1", "IMAGE", "media/media-1.jpg", None, None),
+                ("media-2", "VIDEO", "media/media-2.mp4", None, None),
+            ],
+        )
+        self.assertEqual(pending[1][1], [])
+        conn.close()
+
+    def test_parses_instagram_timestamps(self):
+        module = load_igsync()
+
+        self.assertEqual(
+            module.parse_timestamp("2026-07-16T20:00:00+0000").isoformat(),
+            "2026-07-16T20:00:00+00:00",
+        )
+        self.assertEqual(
+            module.parse_timestamp("2026-07-16T20:00:00Z").isoformat(),
+            "2026-07-16T20:00:00+00:00",
+        )
+
+    def test_deduplicates_caption_tags_case_insensitively(self):
+        module = load_igsync()
+
+        self.assertEqual(
+            module.split_caption("#Sunset at the #beach\n#sunset #Beach #sky")[0],
+            ["Sunset", "beach", "sky"],
+        )
+
+    def test_splits_caption_into_tags_and_text(self):
+        module = load_igsync()
+
+        self.assertEqual(
+            module.split_caption("Evening at the #beach\nwarm #Sunset #sky"),
+            (["beach", "Sunset", "sky"], "Evening at the \nwarm"),
+        )
+
+    def test_resolves_cached_tags_and_creates_only_missing_ones(self):
+        module = load_igsync()
+        cache = {"sunset": 7}
+        created = Mock(status_code=201)
+        created.json.return_value = {"id": 9}
+
+        with patch.object(module.WP_SESSION, "post", return_value=created) as post:
+            self.assertEqual(
+                module.get_or_create_tag("Sunset", cache, "https://example.com"),
+                7,
+            )
+            post.assert_not_called()
+            self.assertEqual(
+                module.get_or_create_tag("beach", cache, "https://example.com"),
+                9,
+            )
+
+        post.assert_called_once()
+        self.assertEqual(cache, {"sunset": 7, "beach": 9})
+
+    def test_skips_tag_when_creation_fails_with_non_json_error(self):
+        module = load_igsync()
+        rejected = Mock(status_code=400)
+        rejected.json.side_effect = ValueError("Expecting value")
+
+        with patch.object(module.WP_SESSION, "post", return_value=rejected):
+            self.assertIsNone(
+                module.get_or_create_tag("beach", {}, "https://example.com")
+            )
+
+    def test_uses_tags_saved_by_earlier_runs_without_listing_wordpress_tags(self):
+        module = load_igsync()
+        conn = module.init_db(":memory:")
+        module.store_tags(conn, {"sunset": 7})
+        store_post(module, conn, "post-1", caption="Evening #Sunset")
+
+        with patch.object(
+            module, "find_live_tag_ids", return_value={7}
+        ), patch.object(module, "load_all_wp_tags") as load_tags, patch.object(
+            module, "create_wordpress_post", return_value=True
+        ) as create_post:
+            module.post_pending_to_wordpress(conn)
+
+        load_tags.assert_not_called()
+        self.assertEqual(create_post.call_args.args[4], [7])
+        conn.close()
+
+    def test_replaces_saved_tags_that_are_gone_from_wordpress(self):
+        module = load_igsync()
+        conn = module.init_db(":memory:")
+        module.store_tags(conn, {"sunset": 7, "merged": 3})
+        store_post(module, conn, "post-1", caption="Evening #Sunset")
+
+        with patch.object(
+            module, "find_live_tag_ids", return_value=set()
+        ), patch.object(
+            module, "load_all_wp_tags", return_value={"sunset": 12}
+        ), patch.object(
+            module, "create_wordpress_post", return_value=True
+        ) as create_post:
+            module.post_pending_to_wordpress(conn)
+
+        self.assertEqual(create_post.call_args.args[4], [12])
+        self.assertEqual(module.get_cached_tags(conn), {"sunset": 12})
+        conn.close()
+
+    def test_creates_each_missing_tag_once_across_pending_posts(self):
+        module = load_igsync()
+        pending = [
+            (("post-1", "#Sunset #beach", "IMAGE", ""), [], (["Sunset", "beach"], "")),
+            (("post-2", "#sunset #sky", "IMAGE", ""), [], (["sunset", "sky"], "")),
+        ]
+
+        with patch.object(module, "get_or_create_tag") as get_or_create:
+            module.create_missing_tags(pending, {"beach": 3})
+
+        self.assertEqual(
+            sorted(call.args[0] for call in get_or_create.call_args_list),
+            ["Sunset", "sky"],
+        )
+
+    def test_wordpress_auth_is_not_replaced_by_netrc(self):
+        module = load_igsync()
+        request = module.requests.Request("GET", "https://example.com/wp-json/wp/v2/tags")
+
+        with patch.object(
+            module.requests.sessions, "get_netrc_auth", return_value=("other", "secret")
+        ):
+            prepared = module.WP_SESSION.prepare_request(request)
+
+        self.assertEqual(prepared.headers["Authorization"], "Basic ZHVtbXk6ZHVtbXk=")
+
+    def test_caps_retry_after_waits(self):
+        module = load_igsync()
+        retry = module.IG_SESSION.get_adapter("https://graph.instagram.com").max_retries
+
+        self.assertEqual(
+            retry.get_retry_after(Mock(headers={"Retry-After": "3600"})),
+            module.RETRY_AFTER_MAX,
+        )
+        self.assertEqual(retry.get_retry_after(Mock(headers={"Retry-After": "5"})), 5)
+
+    def test_stops_paginating_at_first_stored_post(self):
+        module = load_igsync()
+        conn = module.init_db(":memory:")
+        store_post(
+            module, conn, "post-2", caption="Old", timestamp="2026-07-15T20:00:00+0000"
+        )
+        page = Mock(status_code=200)
+        page.json.return_value = {
+            "data": [
+                {"id": "post-3", "media_type": "IMAGE"},
+                {"id": "post-2", "media_type": "IMAGE"},
+                {"id": "post-1", "media_type": "IMAGE"},
+            ],
+            "paging": {"next": "https://graph.instagram.com/next"},
+        }
+
+        with patch.object(module.IG_SESSION, "get", return_value=page) as get:
+            pages = list(module.fetch_instagram_posts("token", conn))
+
+        self.assertEqual(
+            [[post["id"] for post in page] for page in pages], [["post-3", "post-1"]]
+        )
+        get.assert_called_once()
+        conn.close()
+
+    def test_stores_nothing_when_a_later_page_fails(self):
+        module = load_igsync()
+        conn = module.init_db(":memory:")
+        first = Mock(status_code=200)
+        first.json.return_value = {
+            "data": [{"id": "post-2", "media_type": "IMAGE", "media_url": "u"}],
+            "paging": {"next": "https://graph.instagram.com/next"},
+        }
+        failed = Mock(status_code=500)
+
+        with patch.object(module, "get_active_token", return_value="token"), patch.object(
+            module.IG_SESSION, "get", side_effect=[first, failed]
+        ), patch.object(module, "download_media"):
+            with self.assertRaises(RuntimeError):
+                module.fetch_and_store_instagram_posts(conn)
+
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM posts").fetchone(), (0,))
+        conn.close()
+
+    def test_downloads_media_without_leaving_partial_files(self):
+        module = load_igsync()
+        response = MagicMock(status_code=200, raw=io.BytesIO(b"abcdef"))
+        response.__enter__.return_value = response
+
+        with tempfile.TemporaryDirectory() as workdir:
+            path = Path(workdir) / "media-1.jpg"
+            with patch.object(module.IG_SESSION, "get", return_value=response):
+                module.download_media("https://instagram.example/1.jpg", str(path))
+
+            self.assertEqual(path.read_bytes(), b"abcdef")
+            self.assertEqual(os.listdir(workdir), ["media-1.jpg"])
+
+    def test_redownloads_existing_media_with_wrong_size(self):
+        module = load_igsync()
+        head = Mock(status_code=200, headers={"Content-Length": "6"})
+        response = MagicMock(status_code=200, raw=io.BytesIO(b"abcdef"))
+        response.__enter__.return_value = response
+
+        with tempfile.TemporaryDirectory() as workdir:
+            path = Path(workdir) / "media-1.jpg"
+            path.write_bytes(b"abc")
+            with patch.object(module.IG_SESSION, "head", return_value=head), patch.object(
+                module.IG_SESSION, "get", return_value=response
+            ) as get:
+                module.download_media("https://instagram.example/1.jpg", str(path))
+                module.download_media("https://instagram.example/1.jpg", str(path))
+
+            self.assertEqual(path.read_bytes(), b"abcdef")
+        get.assert_called_once()
+
+    def test_skips_listed_local_media_without_checking_the_disk(self):
+        module = load_igsync()
+        head = Mock(status_code=200, headers={"Content-Length": "6"})
+
+        with patch.object(module.IG_SESSION, "head", return_value=head), patch.object(
+            module.os.path, "getsize", return_value=6
+        ), patch.object(module.IG_SESSION, "get") as get:
+            module.download_media(
+                "https://instagram.example/1.jpg",
+                "media/media-1.jpg",
+                frozenset({"media-1.jpg"}),
+            )
+
+        get.assert_not_called()
+
+    def test_stores_carousel_children_and_downloads_each_media(self):
+        module = load_igsync()
+        conn = module.init_db(":memory:")
+        posts = [
+            {
+                "id": "post-1",
+                "caption": "Carousel",
+                "media_type": "CAROUSEL_ALBUM",
+                "permalink": "https://instagram.example/post-1",
+                "timestamp": "2026-07-16T20:00:00+0000",
+            },
+            {
+                "id": "post-2",
+                "caption": "Single",
+                "media_type": "VIDEO",
+                "media_url": "https://instagram.example/post-2.mp4",
+                "permalink": "https://instagram.example/post-2",
+                "timestamp": "2026-07-15T20:00:00+0000",
+            },
+        ]
+        children = [
+            {
+                "id": "child-1",
+                "media_type": "IMAGE",
+                "media_url": "https://instagram.example/child-1.jpg",
+            },
+            {
+                "id": "child-2",
+                "media_type": "IMAGE",
+                "media_url": "https://instagram.example/child-2.jpg",
+            },
+        ]
+
+        with patch.object(module, "get_active_token", return_value="token"), patch.object(
+            module, "fetch_instagram_posts", return_value=[posts[:1], posts[1:]]
+        ), patch.object(module, "fetch_children", return_value=children), patch.object(
+            module, "download_media"
+        ) as download:
+            stored = module.fetch_and_store_instagram_posts(conn)
+
+        self.assertEqual(stored, 2)
+        self.assertEqual(
+            [
+                row[0]
+                for row in conn.execute(
+                    "SELECT media_id FROM media WHERE post_id = 'post-1' ORDER BY rowid"
+                )
+            ],
+            ["child-1", "child-2"],
+        )
+        self.assertEqual(
+            sorted(call.args[1] for call in download.call_args_list),
+            ["media/child-1.jpg", "media/child-2.jpg", "media/post-2.mp4"],
+        )
+        conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()